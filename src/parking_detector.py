@@ -3,7 +3,11 @@ import numpy as np
 import json
 import time
 import os
+import queue
+import threading
+from collections import deque
 import torch
+from numba import njit
 from ultralytics import YOLO
 
 # Конфигурация путей
@@ -21,6 +25,14 @@ os.makedirs(MODELS_DIR, exist_ok=True)
 PARKING_FILE = os.path.join(DATA_DIR, "parking_spaces.json")
 CONFIG_FILE = os.path.join(CONFIG_DIR, "settings.json")
 MODEL_FILE = os.path.join(MODELS_DIR, "yolov8n.pt")
+# TensorRT движок собирается под фиксированный размер пакета, поэтому он входит в имя файла
+ENGINE_FILE_TEMPLATE = os.path.join(MODELS_DIR, "yolov8n_b{batch}.engine")
+
+# Размер входного изображения модели
+INFERENCE_SIZE = 640
+
+# Число неудачных чтений подряд, после которого видеопоток считается потерянным
+MAX_READ_FAILURES = 30
 
 def get_device(config):
     """
@@ -58,6 +70,57 @@ def get_device(config):
         print("ℹ️ CUDA не доступна. Использование CPU.")
         return 'cpu'
 
+def load_model(device, config, batch_size):
+    """
+    Загружает YOLO модель для выбранного устройства.
+    На CUDA используется TensorRT движок (собирается из .pt один раз и сохраняется в models/),
+    при ошибке сборки или загрузки — исходная PyTorch модель.
+    Возвращает (model, is_engine).
+    """
+    if device == 'cuda' and config.get("use_tensorrt", True):
+        engine_file = ENGINE_FILE_TEMPLATE.format(batch=batch_size)
+        try:
+            if not os.path.exists(engine_file):
+                print("🔧 Сборка TensorRT движка (выполняется один раз)...")
+                # Статическая форма входа: движок с фиксированным профилем быстрее динамического
+                exported = YOLO(MODEL_FILE, verbose=False).export(format='engine', imgsz=INFERENCE_SIZE, half=True,
+                                                                  dynamic=False, batch=batch_size, device=0, workspace=4)
+                os.replace(exported, engine_file)
+            model = YOLO(engine_file, task='detect', verbose=False)
+            print("🚀 Используется TensorRT движок")
+            return model, True
+        except Exception as e:
+            print(f"⚠️ TensorRT недоступен ({e}). Используется PyTorch модель.")
+
+    model = YOLO(MODEL_FILE, verbose=False)
+    model.to(device)
+    return model, False
+
+def compile_model(model, sample, batch_size, half):
+    """
+    Компилирует сеть PyTorch модели через torch.compile (слияние ядер, CUDA graphs).
+    Первый вызов создает предиктор Ultralytics, после чего его сеть заменяется скомпилированной;
+    второй вызов выполняет компиляцию заранее, чтобы она не пришлась на первые кадры видео.
+    :param model: YOLO модель
+    :param sample: кадр с размером, как у кадров для инференса
+    :param batch_size: размер пакета кадров
+    :param half: использовать FP16
+    """
+    batch = [sample] * batch_size
+    model(batch, verbose=False, half=half, imgsz=INFERENCE_SIZE)
+    # В новых версиях Ultralytics сеть хранится во вложенном backend объекта AutoBackend
+    backend = model.predictor.model
+    backend = getattr(backend, 'backend', backend)
+    network = backend.model
+    try:
+        print("🔧 Компиляция модели torch.compile...")
+        backend.model = torch.compile(network, mode='reduce-overhead')
+        model(batch, verbose=False, half=half, imgsz=INFERENCE_SIZE)
+        print("🚀 Модель скомпилирована")
+    except Exception as e:
+        backend.model = network
+        print(f"⚠️ torch.compile недоступен ({e}). Используется модель без компиляции.")
+
 # Флаг режима отладки
 debug_mode = False
 # Режим редактирования парковочных мест
@@ -86,25 +149,24 @@ drawing = False
 # Индекс редактируемого парковочного места
 editing_space_index = -1
 
-# Словарь для отслеживания времени нахождения объектов в пограничном состоянии
-# Формат: {space_index: {'start_time': timestamp, 'last_area': float}}
-uncertainty_tracking = {}
-
-# Словарь для отслеживания времени свободности парковочных мест
-# Формат: {space_index: {'free_start_time': timestamp, 'total_free_time': float}}
-free_time_tracking = {}
-
-# Словарь для отслеживания времени занятости парковочных мест
-# Формат: {space_index: {'occupied_start_time': timestamp, 'total_occupied_time': float}}
-occupied_time_tracking = {}
-
-# Словарь для отслеживания частых срабатываний в парковочных местах
-# Формат: {space_index: [timestamps]}
-detection_history = {}
-
-# Словарь для отслеживания состояния частых срабатываний
-# Формат: {space_index: {'frequent_detection': bool, 'last_check': timestamp}}
-frequent_detection_tracking = {}
+# Состояния парковочных мест
+STATE_FREE = 0
+STATE_UNCERTAIN = 1             # Пограничное состояние
+STATE_UNCERTAIN_OCCUPIED = 2    # Вероятно занято
+STATE_FREQUENT_DETECTION = 3    # Частые срабатывания
+STATE_OCCUPIED = 4
+
+# Цвета контуров и подписей по коду состояния (BGR)
+STATE_COLORS = (
+    (0, 255, 0),    # STATE_FREE: зеленый = свободно
+    (0, 255, 255),  # STATE_UNCERTAIN: желтый = неопределенное состояние
+    (0, 100, 255),  # STATE_UNCERTAIN_OCCUPIED: оранжево-красный = вероятно занято
+    (255, 0, 255),  # STATE_FREQUENT_DETECTION: пурпурный = частые срабатывания
+    (0, 0, 255),    # STATE_OCCUPIED: красный = занято
+)
+
+# Емкость кольцевого буфера истории срабатываний на одно место
+DETECTION_HISTORY_SIZE = 64
 
 # Функция для форматирования времени в удобном формате
 def format_time(seconds):
@@ -129,10 +191,59 @@ def format_time(seconds):
         else:
             return f"{days}d"
 
+# Функция для атомарной записи JSON
+def write_json_atomic(data, file, **dumps_kwargs):
+    """
+    Записывает данные в JSON файл через временный файл и os.replace, сбрасывая данные на диск (fsync)
+    до переименования, чтобы при сбое или отключении питания не остался пустой или обрезанный файл.
+    Если файл на диске уже содержит те же данные, он не перезаписывается.
+    :param data: сериализуемые данные
+    :param file: путь к файлу
+    :param dumps_kwargs: параметры json.dumps
+    """
+    content = json.dumps(data, **dumps_kwargs)
+    try:
+        with open(file, "r") as f:
+            if f.read() == content:
+                return
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    tmp_file = file + ".tmp"
+    try:
+        with open(tmp_file, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+    finally:
+        # После успешной замены временного файла уже нет; остается он только при ошибке записи
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    # Сбрасываем и запись каталога, чтобы само переименование пережило отключение питания
+    if os.name == 'posix':
+        dir_fd = os.open(os.path.dirname(os.path.abspath(file)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
 # Функция для сохранения парковочных мест
 def save_parking_spaces(spaces, file):
-    with open(file, "w") as f:
-        json.dump(spaces, f)
+    write_json_atomic(spaces, file, separators=(',', ':'))
+
+# Функция для вычисления ограничивающих прямоугольников парковочных мест
+def compute_spaces_bounds(spaces):
+    """
+    Вычисляет ограничивающие прямоугольники (AABB) парковочных мест
+    :param spaces: список парковочных мест (каждое место — это список точек)
+    :return: массив [x1, y1, x2, y2] формы (N, 4)
+    """
+    spaces_xyxy = np.zeros((len(spaces), 4), np.float32)
+    for i, space in enumerate(spaces):
+        pts = np.asarray(space, np.float32).reshape(-1, 2)
+        spaces_xyxy[i, :2] = pts.min(axis=0)
+        spaces_xyxy[i, 2:] = pts.max(axis=0)
+    return spaces_xyxy
 
 # Функция для загрузки парковочных мест
 def load_parking_spaces(file):
@@ -142,10 +253,108 @@ def load_parking_spaces(file):
     except FileNotFoundError:
         return []
 
+class ParkingGeom:
+    """
+    Кэш геометрии парковочных мест.
+    Пересобирается только при изменении списка мест (создание, редактирование, удаление),
+    а не на каждом кадре.
+    """
+    def __init__(self, spaces):
+        self.rebuild(spaces)
+
+    def rebuild(self, spaces):
+        # Контуры для cv2.polylines и cv2.pointPolygonTest, формы (4, 1, 2)
+        self.pts_list = [np.array(space, np.int32).reshape((-1, 1, 2)) for space in spaces]
+        # Точки привязки подписей (над первой вершиной)
+        self.label_anchors = [(space[0][0], space[0][1] - 10) for space in spaces]
+        # Площади полигонов мест (знаменатель доли перекрытия)
+        self.areas = np.array([cv2.contourArea(pts) for pts in self.pts_list], np.float64)
+        # Ограничивающие прямоугольники для отбора пар место-объект
+        self.xyxy = compute_spaces_bounds(spaces)
+
+class SpaceTracker:
+    """
+    Отслеживание времени состояний парковочных мест в виде массивов NumPy (элемент i — место i).
+    NaN во времени начала означает, что отслеживание для места сейчас не ведется.
+    История срабатываний хранится кольцевым буфером фиксированной емкости history_size на место.
+    """
+    # Поле: (значение по умолчанию, тип)
+    FIELDS = {
+        'occupied_start': (np.nan, np.float64),   # Начало текущего отрезка занятости
+        'total_occupied': (0.0, np.float64),      # Накопленное время занятости
+        'free_start': (np.nan, np.float64),       # Начало текущего отрезка свободности
+        'total_free': (0.0, np.float64),          # Накопленное время свободности
+        'uncertain_start': (np.nan, np.float64),  # Начало пограничного состояния
+        'last_area': (0.0, np.float64),           # Последняя доля перекрытия в пограничном состоянии
+        'object_class': (-1, np.int32),           # Класс объекта в пограничном состоянии
+        'history': (-np.inf, np.float64),         # Время срабатываний, форма (N, history_size)
+        'history_idx': (0, np.int32),             # Позиция следующей записи в кольцевом буфере
+        'detection_count': (0, np.int32),         # Число срабатываний во временном окне
+    }
+
+    def __init__(self, num_spaces, history_size=DETECTION_HISTORY_SIZE):
+        self.history_size = history_size
+        self.reset(num_spaces)
+
+    def _shape(self, name, num_spaces):
+        return (num_spaces, self.history_size) if name == 'history' else (num_spaces,)
+
+    def reset(self, num_spaces):
+        for name, (default, dtype) in self.FIELDS.items():
+            setattr(self, name, np.full(self._shape(name, num_spaces), default, dtype))
+
+    def clear(self):
+        self.reset(len(self.occupied_start))
+
+    def append(self):
+        for name, (default, dtype) in self.FIELDS.items():
+            setattr(self, name, np.concatenate((getattr(self, name), np.full(self._shape(name, 1), default, dtype))))
+
+    def remove(self, idx):
+        for name in self.FIELDS:
+            setattr(self, name, np.delete(getattr(self, name), idx, axis=0))
+
+    def reset_space(self, idx):
+        for name, (default, _) in self.FIELDS.items():
+            getattr(self, name)[idx] = default
+
+class InfoPanel:
+    """
+    Кэш информационной панели. Текст растеризуется заново только при изменении строк или размера кадра,
+    на остальных кадрах готовое изображение панели копируется в кадр по маске одним вызовом cv2.copyTo.
+    """
+    def __init__(self, x=10, y_offset=30, line_height=25):
+        self.x = x
+        self.y_offset = y_offset
+        self.line_height = line_height
+        self.lines = None
+        self.frame_size = None
+
+    def render(self, lines, frame_size):
+        height = min(self.y_offset + len(lines) * self.line_height, frame_size[0])
+        image = np.zeros((height, frame_size[1], 3), np.uint8)
+        mask = np.zeros((height, frame_size[1]), np.uint8)
+        for i, line in enumerate(lines):
+            org = (self.x, self.y_offset + i * self.line_height)
+            # Белая обводка и черный текст поверх нее
+            cv2.putText(image, line, org, cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+            cv2.putText(image, line, org, cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+            cv2.putText(mask, line, org, cv2.FONT_HERSHEY_SIMPLEX, 0.6, 255, 2)
+        self.image = image
+        self.mask = np.where(mask > 127, 255, 0).astype(np.uint8)
+        self.lines = lines
+        self.frame_size = frame_size
+
+    def draw(self, frame, lines):
+        if lines != self.lines or frame.shape[:2] != self.frame_size:
+            self.render(lines, frame.shape[:2])
+        # Срез по строкам непрерывен в памяти, поэтому copyTo пишет прямо в кадр
+        cv2.copyTo(self.image, self.mask, frame[:self.mask.shape[0]])
+
 # Функция для сохранения конфигурации
 def save_config(config, file):
-    with open(file, "w") as f:
-        json.dump(config, f, indent=2)
+    # Отступы сохраняются: файл настроек редактируется вручную и скриптом switch_device.sh
+    write_json_atomic(config, file, indent=2)
 
 # Функция для загрузки конфигурации
 def load_config(file):
@@ -166,47 +375,209 @@ def load_config(file):
         return default_config
 
 # Функция для проверки частых срабатываний
-def check_frequent_detections(space_idx, current_time, threshold, window):
+@njit(cache=True)
+def check_frequent_detections(history, history_idx, detection_count, space_idx, current_time, threshold, window):
     """
-    Проверяет, происходят ли частые срабатывания в парковочном месте
+    Регистрирует срабатывание в парковочном месте и проверяет, происходят ли срабатывания часто
+    :param history: кольцевые буферы времени срабатываний, форма (N, history_size)
+    :param history_idx: позиции следующей записи в буферах, форма (N,)
+    :param detection_count: число срабатываний во временном окне, форма (N,)
     :param space_idx: индекс парковочного места
     :param current_time: текущее время
     :param threshold: порог количества срабатываний
     :param window: временное окно в секундах
     :return: True если есть частые срабатывания
     """
-    if space_idx not in detection_history:
-        detection_history[space_idx] = []
-    
-    # Добавляем текущее время в историю
-    detection_history[space_idx].append(current_time)
-    
-    # Удаляем старые записи (старше временного окна)
+    # Записываем текущее время в кольцевой буфер без выделения памяти под новые списки
+    history_size = history.shape[1]
+    history[space_idx, history_idx[space_idx]] = current_time
+    history_idx[space_idx] = (history_idx[space_idx] + 1) % history_size
+
+    # Считаем срабатывания в пределах временного окна
     cutoff_time = current_time - window
-    detection_history[space_idx] = [t for t in detection_history[space_idx] if t > cutoff_time]
-    
-    # Проверяем количество срабатываний в окне
-    return len(detection_history[space_idx]) >= threshold
-
-# Функция для проверки, находится ли точка внутри полигона
-def point_in_polygon(point, polygon):
-    """Проверяет, находится ли точка внутри полигона"""
-    x, y = point
-    n = len(polygon)
-    inside = False
-    
-    p1x, p1y = polygon[0]
-    for i in range(1, n + 1):
-        p2x, p2y = polygon[i % n]
-        if y > min(p1y, p2y):
-            if y <= max(p1y, p2y):
-                if x <= max(p1x, p2x):
-                    if p1y != p2y:
-                        xinters = (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
-                    if p1x == p2x or x <= xinters:
-                        inside = not inside
-        p1x, p1y = p2x, p2y
-    return inside
+    count = 0
+    for k in range(history_size):
+        if history[space_idx, k] > cutoff_time:
+            count += 1
+    detection_count[space_idx] = count
+    return count >= threshold
+
+# Функция обновления состояний парковочных мест
+@njit(cache=True)
+def _update_states(max_ratios, best_classes, current_time, threshold, uncertainty_threshold,
+                   uncertainty_time_threshold, frequent_detection_threshold, frequent_detection_window,
+                   occupied_start, total_occupied, free_start, total_free, uncertain_start, last_area,
+                   object_class, history, history_idx, detection_count, states):
+    """
+    Автомат состояний парковочных мест: один компилируемый цикл по местам.
+    Массивы отслеживания (поля SpaceTracker) и states изменяются на месте.
+    """
+    for i in range(max_ratios.shape[0]):
+        ratio = max_ratios[i]
+        occupied = ratio >= threshold
+        uncertain = not occupied and ratio >= uncertainty_threshold
+        free = not occupied and not uncertain
+
+        # Время занятости: продолжаем отсчет, начинаем для только что занятого места или сбрасываем
+        if occupied:
+            if np.isnan(occupied_start[i]):
+                total_occupied[i] = 0.0
+            else:
+                total_occupied[i] += current_time - occupied_start[i]
+            occupied_start[i] = current_time
+        else:
+            occupied_start[i] = np.nan
+            total_occupied[i] = 0.0
+
+        # Время свободности — аналогично
+        if free:
+            if np.isnan(free_start[i]):
+                total_free[i] = 0.0
+            else:
+                total_free[i] += current_time - free_start[i]
+            free_start[i] = current_time
+        else:
+            free_start[i] = np.nan
+            total_free[i] = 0.0
+
+        if uncertain:
+            # Пограничное состояние: через uncertainty_time_threshold секунд место считается "вероятно занятым"
+            if np.isnan(uncertain_start[i]):
+                uncertain_start[i] = current_time
+                state = STATE_UNCERTAIN
+            elif current_time - uncertain_start[i] >= uncertainty_time_threshold:
+                state = STATE_UNCERTAIN_OCCUPIED
+            else:
+                state = STATE_UNCERTAIN
+            last_area[i] = ratio
+            object_class[i] = best_classes[i]
+
+            # Частые срабатывания проверяются только в пограничном состоянии
+            if check_frequent_detections(history, history_idx, detection_count, i, current_time,
+                                         frequent_detection_threshold, frequent_detection_window):
+                state = STATE_FREQUENT_DETECTION
+        else:
+            # Вне пограничного состояния история срабатываний очищается
+            uncertain_start[i] = np.nan
+            history[i, :] = -np.inf
+            history_idx[i] = 0
+            detection_count[i] = 0
+            state = STATE_OCCUPIED if occupied else STATE_FREE
+        states[i] = state
+
+# Функция уменьшения кадра до размера входа модели
+def downscale_for_inference(frame, size):
+    """
+    Уменьшает кадр так, чтобы длинная сторона равнялась размеру входа модели.
+    Модель все равно работает на size x size, поэтому точность не меняется,
+    а копирование на устройство и предобработка становятся дешевле.
+    :param frame: исходный кадр
+    :param size: размер входа модели
+    :return: (уменьшенный кадр, коэффициенты (sx, sy) для пересчета координат в исходный кадр)
+    """
+    h, w = frame.shape[:2]
+    if max(h, w) <= size:
+        return frame, (1.0, 1.0)
+    ratio = size / max(h, w)
+    small_w, small_h = round(w * ratio), round(h * ratio)
+    small = cv2.resize(frame, (small_w, small_h), interpolation=cv2.INTER_AREA)
+    return small, (w / small_w, h / small_h)
+
+# Функция пересчета координат рамок из уменьшенного кадра в исходный
+def scale_boxes(detections, scale):
+    """
+    Пересчитывает координаты рамок детекций в исходный кадр (на месте)
+    :param detections: массив строк [x1, y1, x2, y2, conf, cls]
+    :param scale: коэффициенты (sx, sy) из downscale_for_inference
+    :return: тот же массив в координатах исходного кадра
+    """
+    sx, sy = scale
+    if sx != 1.0 or sy != 1.0:
+        detections[:, :4] *= (sx, sy, sx, sy)
+    return detections
+
+# Функция копирования детекций пакета кадров на CPU
+def collect_detections(results, scales):
+    """
+    Копирует детекции всех кадров пакета на CPU одной передачей и пересчитывает рамки в исходные кадры
+    :param results: результаты модели по кадрам пакета
+    :param scales: коэффициенты (sx, sy) кадров из downscale_for_inference
+    :return: список массивов float32 строк [x1, y1, x2, y2, conf, cls] формы (M, 6), по одному на кадр
+    """
+    boxes = [result.boxes.data for result in results]
+    host = torch.cat(boxes).float().cpu().numpy()
+    batch = np.split(host, np.cumsum([len(b) for b in boxes])[:-1])
+    return [scale_boxes(detections, scale) for detections, scale in zip(batch, scales)]
+
+# Функция вычисления сигнатуры кадра для детектора движения
+def frame_signature(frame):
+    """
+    Возвращает дешевую сигнатуру кадра: уменьшенную до 64x64 полутоновую копию
+    :param frame: кадр BGR
+    :return: массив int16 формы (64, 64)
+    """
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (64, 64), interpolation=cv2.INTER_AREA).astype(np.int16)
+
+# Функция чтения кадров видеопотока в отдельном потоке
+def read_frames(cap, frame_queue, stop_event, inference_size):
+    """
+    Читает кадры в ограниченную очередь, чтобы декодирование шло параллельно с инференсом.
+    Там же готовит уменьшенную копию кадра для модели и его сигнатуру для детектора движения.
+    При окончании видео перематывает его на начало. Поток, который перемотать нельзя (камера, сеть),
+    при ошибках чтения опрашивается с растущей паузой; после MAX_READ_FAILURES ошибок подряд чтение прекращается.
+    :param cap: объект cv2.VideoCapture
+    :param frame_queue: очередь кортежей (кадр, уменьшенный кадр, коэффициенты масштаба, сигнатура)
+    :param stop_event: событие остановки потока
+    :param inference_size: размер входа модели
+    """
+    failures = 0
+    while not stop_event.is_set():
+        ret, frame = cap.read()
+        if not ret:
+            failures += 1
+            # Конец файла: перематываем и сразу читаем снова
+            if failures == 1 and cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+                continue
+            if failures >= MAX_READ_FAILURES:
+                print("Видеопоток недоступен, чтение кадров остановлено.")
+                return
+            # Пауза между попытками вместо холостого цикла; прерывается флагом остановки
+            stop_event.wait(min(0.05 * failures, 1.0))
+            continue
+        failures = 0
+        small, scale = downscale_for_inference(frame, inference_size)
+        signature = frame_signature(small)
+        # Ждем места в очереди, периодически проверяя флаг остановки
+        while not stop_event.is_set():
+            try:
+                frame_queue.put((frame, small, scale, signature), timeout=0.1)
+                break
+            except queue.Full:
+                continue
+
+# Функция получения пакета кадров из очереди
+def take_frames(frame_queue, reader_thread, frames, count, timeout=0.1):
+    """
+    Дополняет пакет кадрами из очереди до count, ожидая не дольше timeout секунд.
+    Не блокирует основной цикл надолго: пока пакет не собран, окно продолжает обрабатывать события.
+    :param frame_queue: очередь кадров, заполняемая read_frames
+    :param reader_thread: поток чтения кадров
+    :param frames: собираемый пакет (список), дополняется на месте
+    :param count: размер пакета
+    :param timeout: максимальное время ожидания в секундах
+    :return: True — пакет собран, False — кадров пока не хватает,
+             None — поток чтения завершился и новых кадров не будет
+    """
+    deadline = time.perf_counter() + timeout
+    while len(frames) < count:
+        try:
+            frames.append(frame_queue.get(timeout=max(deadline - time.perf_counter(), 0)))
+        except queue.Empty:
+            if not reader_thread.is_alive() and frame_queue.empty():
+                return None
+            return False
+    return True
 
 # Функция обработки мышиных событий
 def draw_parking_space(event, x, y, flags, param):
@@ -225,8 +596,10 @@ def draw_parking_space(event, x, y, flags, param):
         # Режим удаления парковочных мест
         if event == cv2.EVENT_LBUTTONDOWN:
             for i, space in enumerate(parking_spaces):
-                if len(space) == 4 and point_in_polygon((x, y), space):
+                if len(space) == 4 and cv2.pointPolygonTest(parking_geom.pts_list[i], (float(x), float(y)), False) >= 0:
                     del parking_spaces[i]
+                    parking_geom.rebuild(parking_spaces)
+                    space_tracker.remove(i)
                     print(f"Место {i} удалено")
                     break
     elif edit_mode:
@@ -235,7 +608,7 @@ def draw_parking_space(event, x, y, flags, param):
             if editing_space_index == -1:
                 # Выбор парковочного места для редактирования
                 for i, space in enumerate(parking_spaces):
-                    if len(space) == 4 and point_in_polygon((x, y), space):
+                    if len(space) == 4 and cv2.pointPolygonTest(parking_geom.pts_list[i], (float(x), float(y)), False) >= 0:
                         editing_space_index = i
                         current_parking_space = space.copy()
                         print(f"Редактирование места {i}")
@@ -246,6 +619,8 @@ def draw_parking_space(event, x, y, flags, param):
                     current_parking_space.append((x, y))
                 if len(current_parking_space) == 4:
                     parking_spaces[editing_space_index] = current_parking_space.copy()
+                    parking_geom.rebuild(parking_spaces)
+                    space_tracker.reset_space(editing_space_index)
                     print(f"Место {editing_space_index} обновлено")
                     current_parking_space = []
                     editing_space_index = -1
@@ -256,149 +631,74 @@ def draw_parking_space(event, x, y, flags, param):
                 current_parking_space.append((x, y))
             if len(current_parking_space) == 4:
                 parking_spaces.append(current_parking_space)
+                parking_geom.rebuild(parking_spaces)
+                space_tracker.append()
                 print(f"Место {len(parking_spaces)-1} создано")
                 current_parking_space = []
 
 
-def check_parking_spaces(parking_spaces, detections, tracked_objects, threshold, uncertainty_threshold, universal_detection, uncertainty_tracking, uncertainty_time_threshold, free_time_tracking, occupied_time_tracking, frequent_detection_threshold, frequent_detection_window):
+def check_parking_spaces(geom, detections, tracked_objects, threshold, uncertainty_threshold, universal_detection, tracker, uncertainty_time_threshold, frequent_detection_threshold, frequent_detection_window, current_time):
     """
     Проверяет, заняты ли парковочные места с поддержкой пограничных состояний, отслеживанием времени и частых срабатываний.
-    :param parking_spaces: список парковочных мест (каждое место — это список из 4 точек).
-    :param detections: детектированные объекты, список [x1, y1, x2, y2, conf, cls].
+    Пары место-объект отбираются одной матрицей пересечений AABB (N мест x M объектов);
+    точная площадь пересечения полигона места с рамкой объекта считается только для отобранных пар.
+    :param geom: кэш геометрии парковочных мест (ParkingGeom).
+    :param detections: детектированные объекты, массив строк [x1, y1, x2, y2, conf, cls] формы (M, 6).
     :param tracked_objects: список классов объектов для трекера.
     :param threshold: порог занятости места (0.0-1.0).
     :param uncertainty_threshold: порог для пограничного состояния (0.0-1.0).
     :param universal_detection: использовать ли универсальное распознавание.
-    :param uncertainty_tracking: словарь отслеживания пограничных состояний.
+    :param tracker: массивы отслеживания времени состояний (SpaceTracker).
     :param uncertainty_time_threshold: время для перехода в "вероятно занято".
-    :param free_time_tracking: словарь отслеживания времени свободности.
-    :param occupied_time_tracking: словарь отслеживания времени занятости.
     :param frequent_detection_threshold: порог частых срабатываний.
     :param frequent_detection_window: временное окно для частых срабатываний.
-    :return: список состояний мест ('occupied', 'free', 'uncertain', 'frequent_detection').
+    :param current_time: время кадра (time.perf_counter()).
+    :return: массив кодов состояний мест (STATE_*).
     """
-    current_time = time.time()
-    states = []
-    
-    for space_idx, space in enumerate(parking_spaces):
-        # Преобразуем координаты парковочного места в полигон
-        pts = np.array(space, np.int32).reshape((-1, 1, 2))
-        space_area = cv2.contourArea(pts)
-        max_overlap_ratio = 0.0
-        best_object_class = None
-
-        # Проверяем пересечение с каждым детектированным объектом
-        for det in detections:
-            x1, y1, x2, y2, conf, cls = det
-            
-            # Фильтрация объектов в зависимости от режима
-            if not universal_detection and int(cls) not in tracked_objects:
+    spaces_xyxy = geom.xyxy
+    num_spaces = len(spaces_xyxy)
+
+    max_ratios = np.zeros(num_spaces, np.float64)
+    best_classes = np.full(num_spaces, -1, np.int32)
+
+    if num_spaces and len(detections):
+        # Отбор пар место-объект: матрица пересечений AABB (N, M) через broadcasting координат
+        dets_xyxy = detections[:, :4]
+        ix1 = np.maximum(spaces_xyxy[:, None, 0], dets_xyxy[None, :, 0])
+        iy1 = np.maximum(spaces_xyxy[:, None, 1], dets_xyxy[None, :, 1])
+        ix2 = np.minimum(spaces_xyxy[:, None, 2], dets_xyxy[None, :, 2])
+        iy2 = np.minimum(spaces_xyxy[:, None, 3], dets_xyxy[None, :, 3])
+        candidates = (ix2 > ix1) & (iy2 > iy1)
+        # Фильтрация объектов в зависимости от режима
+        if not universal_detection:
+            candidates &= np.isin(detections[:, 5].astype(np.int32), tracked_objects)[None, :]
+        # Индексы отобранных пар (по местам, затем по объектам)
+        pairs = np.argwhere(candidates)
+        # Рамки объектов как полигоны [[x1, y1], [x2, y1], [x2, y2], [x1, y2]]
+        rects = detections[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+
+        # Точное пересечение полигона места с рамкой объекта; доля — от площади полигона
+        for space_idx, det_idx in pairs:
+            space_area = geom.areas[space_idx]
+            if space_area <= 0:
                 continue
-
-            # Преобразуем объект в прямоугольник
-            obj_rect = np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
-
-            # Проверяем пересечение
             try:
-                overlap, _ = cv2.intersectConvexConvex(pts, obj_rect)
-                overlap_ratio = overlap / space_area if space_area > 0 else 0
-                
-                if overlap_ratio > max_overlap_ratio:
-                    max_overlap_ratio = overlap_ratio
-                    best_object_class = int(cls)
-            except:
+                overlap, _ = cv2.intersectConvexConvex(geom.pts_list[space_idx], rects[det_idx])
+            except cv2.error:
                 # Если произошла ошибка при вычислении пересечения, пропускаем
                 continue
+            overlap_ratio = overlap / space_area
+            if overlap_ratio > max_ratios[space_idx]:
+                max_ratios[space_idx] = overlap_ratio
+                best_classes[space_idx] = int(detections[det_idx, 5])
+
+    states = np.empty(num_spaces, np.int8)
+    _update_states(max_ratios, best_classes, current_time, threshold, uncertainty_threshold,
+                   uncertainty_time_threshold, frequent_detection_threshold, frequent_detection_window,
+                   tracker.occupied_start, tracker.total_occupied, tracker.free_start, tracker.total_free,
+                   tracker.uncertain_start, tracker.last_area, tracker.object_class,
+                   tracker.history, tracker.history_idx, tracker.detection_count, states)
 
-        # Определяем состояние парковочного места
-        if max_overlap_ratio >= threshold:
-            # Место определенно занято
-            state = 'occupied'
-            # Очищаем отслеживание пограничного состояния
-            if space_idx in uncertainty_tracking:
-                del uncertainty_tracking[space_idx]
-            # Очищаем отслеживание времени свободности
-            if space_idx in free_time_tracking:
-                del free_time_tracking[space_idx]
-            # Очищаем историю детекций при полной занятости
-            if space_idx in detection_history:
-                del detection_history[space_idx]
-            
-            # Отслеживаем время занятости
-            if space_idx not in occupied_time_tracking:
-                # Начинаем отслеживание времени занятости
-                occupied_time_tracking[space_idx] = {
-                    'occupied_start_time': current_time,
-                    'total_occupied_time': 0.0
-                }
-            else:
-                # Обновляем общее время занятости
-                time_since_last_update = current_time - occupied_time_tracking[space_idx]['occupied_start_time']
-                occupied_time_tracking[space_idx]['total_occupied_time'] += time_since_last_update
-                occupied_time_tracking[space_idx]['occupied_start_time'] = current_time
-        elif max_overlap_ratio >= uncertainty_threshold:
-            # Пограничное состояние - объект частично перекрывает место
-            # Проверяем частые срабатывания только в пограничном состоянии
-            has_frequent_detections = check_frequent_detections(space_idx, current_time, frequent_detection_threshold, frequent_detection_window)
-            
-            if space_idx not in uncertainty_tracking:
-                # Начинаем отслеживание пограничного состояния
-                uncertainty_tracking[space_idx] = {
-                    'start_time': current_time,
-                    'last_area': max_overlap_ratio,
-                    'object_class': best_object_class
-                }
-                state = 'uncertain'
-            else:
-                # Обновляем информацию о пограничном состоянии
-                uncertainty_tracking[space_idx]['last_area'] = max_overlap_ratio
-                uncertainty_tracking[space_idx]['object_class'] = best_object_class
-                
-                # Проверяем, не прошло ли достаточно времени
-                time_in_uncertainty = current_time - uncertainty_tracking[space_idx]['start_time']
-                if time_in_uncertainty >= uncertainty_time_threshold:
-                    state = 'uncertain_occupied'  # Вероятно занято
-                else:
-                    state = 'uncertain'
-            
-            # Если есть частые срабатывания в пограничном состоянии, считаем место занятым
-            if has_frequent_detections:
-                state = 'frequent_detection'
-            
-            # Очищаем отслеживание времени свободности в пограничном состоянии
-            if space_idx in free_time_tracking:
-                del free_time_tracking[space_idx]
-            # Очищаем отслеживание времени занятости в пограничном состоянии
-            if space_idx in occupied_time_tracking:
-                del occupied_time_tracking[space_idx]
-        else:
-            # Место свободно
-            state = 'free'
-            # Очищаем отслеживание пограничного состояния
-            if space_idx in uncertainty_tracking:
-                del uncertainty_tracking[space_idx]
-            # Очищаем отслеживание времени занятости
-            if space_idx in occupied_time_tracking:
-                del occupied_time_tracking[space_idx]
-            # Очищаем историю детекций при освобождении места
-            if space_idx in detection_history:
-                del detection_history[space_idx]
-            
-            # Отслеживаем время свободности
-            if space_idx not in free_time_tracking:
-                # Начинаем отслеживание времени свободности
-                free_time_tracking[space_idx] = {
-                    'free_start_time': current_time,
-                    'total_free_time': 0.0
-                }
-            else:
-                # Обновляем общее время свободности
-                time_since_last_update = current_time - free_time_tracking[space_idx]['free_start_time']
-                free_time_tracking[space_idx]['total_free_time'] += time_since_last_update
-                free_time_tracking[space_idx]['free_start_time'] = current_time
-
-        states.append(state)
-    
     return states
 
 
@@ -415,12 +715,24 @@ tracked_objects = config.get("tracked_objects", [2, 67])
 # Определение устройства
 device = get_device(config)
 
+# Размер пакета кадров для инференса (на GPU пакет лучше загружает устройство)
+batch_size = config.get("batch_size", 8 if device == 'cuda' else 1)
+
 # Загрузка YOLO модели (отключаем вывод в консоль)
-model = YOLO(MODEL_FILE, verbose=False)
-model.to(device)
+model, model_is_engine = load_model(device, config, batch_size)
+
+# На CUDA используем половинную точность (FP16) и автоподбор алгоритмов cuDNN под фиксированный размер входа
+# (TensorRT движок уже собран в FP16). Веса в FP16 переводит сам предиктор (half=True при вызове) после
+# слияния Conv+BN, поэтому заранее модель не приводится — иначе слияние шло бы в FP16 с потерей точности
+use_half = device == 'cuda'
+if use_half and not model_is_engine:
+    torch.backends.cudnn.benchmark = True
 
 # Загрузка парковочных мест
 parking_spaces = load_parking_spaces(PARKING_FILE)
+parking_geom = ParkingGeom(parking_spaces)
+# Емкость буфера не меньше порога, иначе порог частых срабатываний недостижим
+space_tracker = SpaceTracker(len(parking_spaces), max(frequent_detection_threshold, DETECTION_HISTORY_SIZE))
 
 # Видео поток
 video_path = '/home/user/park_place_detector/parking1.mp4'
@@ -431,45 +743,102 @@ if not cap.isOpened():
     print("Ошибка подключения к видеопотоку.")
     exit(1)
 
+# Компиляция PyTorch модели на CUDA (TensorRT движок уже оптимизирован).
+# Прогрев выполняется на кадре размера видео, чтобы форма входа совпадала с реальной
+if use_half and not model_is_engine and config.get("torch_compile", True):
+    frame_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or INFERENCE_SIZE
+    frame_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or INFERENCE_SIZE
+    sample, _ = downscale_for_inference(np.zeros((frame_h, frame_w, 3), np.uint8), INFERENCE_SIZE)
+    compile_model(model, sample, batch_size, use_half)
+
 cv2.namedWindow("Parking Detection")
-cv2.setMouseCallback("Parking Detection", draw_parking_space)
+# Обработчик мыши регистрируется один раз; детекции текущего кадра обновляются в словаре параметров
+mouse_param = {'detections': []}
+cv2.setMouseCallback("Parking Detection", draw_parking_space, mouse_param)
+
+# Чтение кадров в фоновом потоке: пока идет инференс текущего кадра, декодируется следующий
+frame_queue = queue.Queue(maxsize=2 * batch_size)
+stop_event = threading.Event()
+reader_thread = threading.Thread(target=read_frames, args=(cap, frame_queue, stop_event, INFERENCE_SIZE), daemon=True)
+reader_thread.start()
+
+# Кэш информационной панели
+info_panel = InfoPanel()
+
+# Кадры с результатами распознавания, ожидающие отрисовки
+pending_frames = deque()
+
+# Порог движения: максимальная разница яркости ячеек сигнатуры (0-255), ниже которого инференс пропускается.
+# Берется максимум, а не среднее: одна машина на большой парковке почти не меняет среднюю яркость кадра
+motion_threshold = config.get("motion_threshold", 10)
+# Сигнатура кадра и детекции последнего распознанного кадра
+last_signature = None
+last_detections = None
+# Собираемый пакет кадров
+frames_batch = []
 
 # Основной цикл обработки видео
 while True:
-    ret, frame = cap.read()
-    if not ret:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
-        continue
-
-    # Распознавание объектов (отключаем вывод в консоль)
-    results = model(frame, verbose=False)
-    detections = results[0].boxes.data.cpu().numpy() if results[0].boxes else []
+    # Распознавание объектов пакетом из batch_size кадров (отключаем вывод в консоль)
+    # Модель получает уменьшенные кадры, отрисовка идет на исходных
+    if not pending_frames:
+        batch_ready = take_frames(frame_queue, reader_thread, frames_batch, batch_size)
+        if batch_ready is None:
+            print("Поток чтения кадров остановлен.")
+            break
+        if not batch_ready:
+            # Пакет еще не собран: обрабатываем события окна, чтобы интерфейс не зависал и работал выход по Q
+            if cv2.waitKey(1) & 0xFF == ord("q"):
+                print("Выход из программы...")
+                break
+            continue
+        # Если ни один кадр пакета не отличается от последнего распознанного, повторно используем его детекции
+        motion = last_signature is None or any(
+            np.abs(signature - last_signature).max() >= motion_threshold for *_, signature in frames_batch)
+        if motion:
+            results_batch = model([small for _, small, _, _ in frames_batch], verbose=False, half=use_half, imgsz=INFERENCE_SIZE)
+            # Одна копия детекций на CPU на весь пакет; кадры без движения используют ее повторно
+            batch_detections = collect_detections(results_batch, [scale for _, _, scale, _ in frames_batch])
+            last_signature = frames_batch[-1][3]
+            last_detections = batch_detections[-1]
+        else:
+            batch_detections = [last_detections] * len(frames_batch)
+        pending_frames.extend((frame, dets) for (frame, *_), dets in zip(frames_batch, batch_detections))
+        frames_batch = []
+    # Состояния мест пересчитываются на каждом кадре, чтобы таймеры шли и без инференса
+    frame, detections = pending_frames.popleft()
+    # Единое монотонное время кадра для состояний, подписей и статистики
+    now = time.perf_counter()
 
     # Инициализация переменной для состояний парковочных мест
     space_states = []
 
     # Отрисовка объектов в режиме отладки
     if debug_mode:
-        for det in detections:
-            x1, y1, x2, y2, conf, cls = map(int, det[:6])
+        # Приведение типов один раз для всех детекций, а не поэлементно в цикле
+        boxes = detections[:, :4].astype(np.int32).tolist()
+        confs = detections[:, 4].tolist()
+        classes = detections[:, 5].astype(np.int32)
+        is_tracked = np.isin(classes, tracked_objects).tolist()
+        for (x1, y1, x2, y2), conf, cls, tracked in zip(boxes, confs, classes.tolist(), is_tracked):
             label = f"{model.names[cls]} {conf:.2f}"
-            color = (255, 255, 0) if cls in tracked_objects else (0, 255, 255)
+            color = (255, 255, 0) if tracked else (0, 255, 255)
             cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
             cv2.putText(frame, label, (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
     # Проверка парковочных мест, если не debug_mode
     if not debug_mode:
-        space_states = check_parking_spaces(parking_spaces, detections, tracked_objects, 
+        space_states = check_parking_spaces(parking_geom, detections, tracked_objects, 
                                           occupancy_threshold, uncertainty_threshold, 
-                                          universal_detection, uncertainty_tracking, 
-                                          uncertainty_time_threshold, free_time_tracking, 
-                                          occupied_time_tracking, frequent_detection_threshold, 
-                                          frequent_detection_window)
+                                          universal_detection, space_tracker, 
+                                          uncertainty_time_threshold, frequent_detection_threshold, 
+                                          frequent_detection_window, now)
         
+        # Контуры группируются по цвету, подписи рисуются после контуров
+        color_groups = {}
+        space_labels = []
         for i, space in enumerate(parking_spaces):
             if len(space) == 4:
-                pts = np.array(space, np.int32).reshape((-1, 1, 2))
-                
                 # Определяем цвет в зависимости от режима и состояния
                 if edit_mode and i == editing_space_index:
                     color = (255, 0, 255)  # Фиолетовый для редактируемого места
@@ -479,49 +848,37 @@ while True:
                     label = "DELETE"
                 else:
                     # Определяем цвет и подпись на основе состояния
-                    if space_states[i] == 'occupied':
-                        color = (0, 0, 255)  # Красный = занято
+                    color = STATE_COLORS[space_states[i]]
+                    if space_states[i] == STATE_OCCUPIED:
                         # Показываем время занятости
-                        if i in occupied_time_tracking:
-                            current_occupied_time = time.time() - occupied_time_tracking[i]['occupied_start_time']
-                            total_occupied_time = occupied_time_tracking[i]['total_occupied_time'] + current_occupied_time
-                            formatted_time = format_time(total_occupied_time)
-                            label = f"Occupied ({formatted_time})"
-                        else:
-                            label = "Occupied"
-                    elif space_states[i] == 'frequent_detection':
-                        color = (255, 0, 255)  # Пурпурный = частые срабатывания
+                        current_occupied_time = now - space_tracker.occupied_start[i]
+                        total_occupied_time = space_tracker.total_occupied[i] + current_occupied_time
+                        formatted_time = format_time(total_occupied_time)
+                        label = f"Occupied ({formatted_time})"
+                    elif space_states[i] == STATE_FREQUENT_DETECTION:
                         # Показываем количество срабатываний
-                        if i in detection_history:
-                            detections_count = len(detection_history[i])
-                            label = f"Frequent ({detections_count})"
-                        else:
-                            label = "Frequent Detection"
-                    elif space_states[i] == 'uncertain_occupied':
-                        color = (0, 100, 255)  # Оранжево-красный = вероятно занято
+                        label = f"Frequent ({space_tracker.detection_count[i]})"
+                    elif space_states[i] == STATE_UNCERTAIN_OCCUPIED:
                         label = "Probably Occupied"
-                    elif space_states[i] == 'uncertain':
-                        color = (0, 255, 255)  # Желтый = неопределенное состояние
+                    elif space_states[i] == STATE_UNCERTAIN:
                         # Показываем время в пограничном состоянии
-                        if i in uncertainty_tracking:
-                            time_in_uncertainty = time.time() - uncertainty_tracking[i]['start_time']
-                            label = f"Uncertain ({time_in_uncertainty:.1f}s)"
-                        else:
-                            label = "Uncertain"
-                    else:  # 'free'
-                        color = (0, 255, 0)  # Зеленый = свободно
+                        time_in_uncertainty = now - space_tracker.uncertain_start[i]
+                        label = f"Uncertain ({time_in_uncertainty:.1f}s)"
+                    else:  # STATE_FREE
                         # Показываем время свободности
-                        if i in free_time_tracking:
-                            current_free_time = time.time() - free_time_tracking[i]['free_start_time']
-                            total_free_time = free_time_tracking[i]['total_free_time'] + current_free_time
-                            formatted_time = format_time(total_free_time)
-                            label = f"Free ({formatted_time})"
-                        else:
-                            label = "Free"
-                
-                cv2.polylines(frame, [pts], isClosed=True, color=color, thickness=2)
-                cv2.putText(frame, label, (space[0][0], space[0][1] - 10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                        current_free_time = now - space_tracker.free_start[i]
+                        total_free_time = space_tracker.total_free[i] + current_free_time
+                        formatted_time = format_time(total_free_time)
+                        label = f"Free ({formatted_time})"
+
+                color_groups.setdefault(color, []).append(parking_geom.pts_list[i])
+                space_labels.append((label, parking_geom.label_anchors[i], color))
+
+        # Один вызов cv2.polylines на цвет вместо вызова на каждое место
+        for color, contours in color_groups.items():
+            cv2.polylines(frame, contours, isClosed=True, color=color, thickness=2)
+        for label, anchor, color in space_labels:
+            cv2.putText(frame, label, anchor, cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
     # Отрисовка текущего редактируемого парковочного места
     if edit_mode and current_parking_space:
@@ -564,45 +921,30 @@ while True:
     info_text.append(f"Uncertainty threshold: {uncertainty_threshold*100:.0f}%")
     
     # Статистика парковочных мест
-    if not debug_mode and space_states:
-        occupied_count = sum(1 for state in space_states if state == 'occupied')
-        uncertain_count = sum(1 for state in space_states if state in ['uncertain', 'uncertain_occupied'])
-        frequent_count = sum(1 for state in space_states if state == 'frequent_detection')
-        free_count = sum(1 for state in space_states if state == 'free')
+    if not debug_mode and len(space_states):
+        occupied_count = np.count_nonzero(space_states == STATE_OCCUPIED)
+        uncertain_count = np.count_nonzero((space_states == STATE_UNCERTAIN) | (space_states == STATE_UNCERTAIN_OCCUPIED))
+        frequent_count = np.count_nonzero(space_states == STATE_FREQUENT_DETECTION)
+        free_count = np.count_nonzero(space_states == STATE_FREE)
         info_text.append(f"Spaces: {occupied_count} occupied, {uncertain_count} uncertain, {frequent_count} frequent, {free_count} free")
         
         # Статистика времени свободности и занятости
-        current_time = time.time()
-        free_times = []
-        occupied_times = []
-        
-        # Собираем статистику времени свободности
-        if free_time_tracking:
-            for space_idx, tracking_data in free_time_tracking.items():
-                if space_idx < len(space_states) and space_states[space_idx] == 'free':
-                    current_free_time = current_time - tracking_data['free_start_time']
-                    total_free_time = tracking_data['total_free_time'] + current_free_time
-                    free_times.append(total_free_time)
-        
-        # Собираем статистику времени занятости
-        if occupied_time_tracking:
-            for space_idx, tracking_data in occupied_time_tracking.items():
-                if space_idx < len(space_states) and space_states[space_idx] == 'occupied':
-                    current_occupied_time = current_time - tracking_data['occupied_start_time']
-                    total_occupied_time = tracking_data['total_occupied_time'] + current_occupied_time
-                    occupied_times.append(total_occupied_time)
+        free_mask = space_states == STATE_FREE
+        occupied_mask = space_states == STATE_OCCUPIED
+        free_times = space_tracker.total_free[free_mask] + (now - space_tracker.free_start[free_mask])
+        occupied_times = space_tracker.total_occupied[occupied_mask] + (now - space_tracker.occupied_start[occupied_mask])
         
         # Отображаем статистику
-        if free_times:
-            avg_free_time = sum(free_times) / len(free_times)
-            max_free_time = max(free_times)
+        if len(free_times):
+            avg_free_time = free_times.mean()
+            max_free_time = free_times.max()
             avg_formatted = format_time(avg_free_time)
             max_formatted = format_time(max_free_time)
             info_text.append(f"Free: avg {avg_formatted}, max {max_formatted}")
         
-        if occupied_times:
-            avg_occupied_time = sum(occupied_times) / len(occupied_times)
-            max_occupied_time = max(occupied_times)
+        if len(occupied_times):
+            avg_occupied_time = occupied_times.mean()
+            max_occupied_time = occupied_times.max()
             avg_formatted = format_time(avg_occupied_time)
             max_formatted = format_time(max_occupied_time)
             info_text.append(f"Occupied: avg {avg_formatted}, max {max_formatted}")
@@ -611,16 +953,11 @@ while True:
     
     info_text.append("Keys: D=Debug, E=Edit, R=Delete, U=Universal, S=Save, C=Clear, Q=Quit")
     
-    # Отрисовка информационной панели
-    y_offset = 30
-    for i, text in enumerate(info_text):
-        cv2.putText(frame, text, (10, y_offset + i * 25), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-        cv2.putText(frame, text, (10, y_offset + i * 25), 
-                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+    # Отрисовка информационной панели (текст растеризуется только при изменении строк)
+    info_panel.draw(frame, info_text)
 
     cv2.imshow("Parking Detection", frame)
-    cv2.setMouseCallback("Parking Detection", draw_parking_space, param={'detections': detections})
+    mouse_param['detections'] = detections
 
     key = cv2.waitKey(1) & 0xFF
     if key == ord("q"):
@@ -654,11 +991,7 @@ while True:
         # Переключение режима детекции
         universal_detection = not universal_detection
         # Очищаем отслеживание пограничных состояний при смене режима
-        uncertainty_tracking.clear()
-        free_time_tracking.clear()
-        occupied_time_tracking.clear()
-        detection_history.clear()
-        frequent_detection_tracking.clear()
+        space_tracker.clear()
         print(f"Detection: {'Universal' if universal_detection else 'Cars only'}")
     elif key == ord("c"):
         # Сброс всех режимов
@@ -667,12 +1000,11 @@ while True:
         delete_mode = False
         editing_space_index = -1
         current_parking_space = []
-        uncertainty_tracking.clear()
-        free_time_tracking.clear()
-        occupied_time_tracking.clear()
-        detection_history.clear()
-        frequent_detection_tracking.clear()
+        space_tracker.clear()
         print("Сброс")
 
+stop_event.set()
+# Поток демонический: если он завис в cap.read() на сетевом потоке, не ждем его дольше секунды
+reader_thread.join(timeout=1.0)
 cap.release()
 cv2.destroyAllWindows()